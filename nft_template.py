@@ -42,8 +42,31 @@ TOKEN_NAME = 'Non-Fungible Token Template'
 TOKEN_SYMBOL = 'NFT'
 TOKEN_DECIMALS = 0
 TOKEN_CIRC_KEY = b'in_circulation'
+TOKEN_ID_MAX_LENGTH = 32  # longest token id mintToken accepts, in bytes
+DEBUG = False  # set to True to log informational messages on success paths
+
+# Config storage keys
+NAME_KEY = b'name'
+SYMBOL_KEY = b'symbol'
+SUPPORTED_STANDARDS_KEY = b'supportedStandards'
+
+# Storage key prefixes (single-byte tags keep every per-token key short;
+# every per-token key gets its own tag, because token ids vary in length
+# and an untagged ``owner + id`` key could equal ``tag + id``)
+TOKEN_PREFIX = b'\x01'
+OWNERSHIP_PREFIX = b'\x02'  # owner (20 bytes) + approved spender (20 bytes, optional)
+EXCHANGE_PREFIX = b'\x03'
+BALANCE_PREFIX = b'\x04'
+RW_PROPERTIES_PREFIX = b'\x05'
+PROPERTIES_PREFIX = b'\x06'
+OWNERS_LIST_PREFIX = b'\x07'  # + owner (20 bytes) + token id
 
 # Smart Contract Event Notifications
+# The NEP-5 style approve/transfer/mint events duplicate their NFT
+# counterparts and are only kept for older blockchain trackers; set
+# this to False to compile them out
+EMIT_LEGACY_EVENTS = True
+
 OnApprove = RegisterAction('approve', 'addr_from', 'addr_to', 'amount')
 OnNFTApprove = RegisterAction('NFTapprove', 'addr_from', 'addr_to', 'tokenid')
 OnTransfer = RegisterAction('transfer', 'addr_from', 'addr_to', 'amount')
@@ -86,7 +109,18 @@ def Main(operation, args):
         `token_id`
     - tokensOfOwner(owner, starting_index): returns a dictionary that
         contains less than or equal to ten of the tokens owned by
-        the specified address starting at the `starting_index`.
+        the specified address starting at the `starting_index`,
+        mapping each token id to the token's serialized data, so
+        each value has to be deserialized again. This is not the
+        format earlier versions returned (decoded records keyed by
+        'token/' + id); prefer tokensOfOwnerRaw.
+    - tokensOfOwnerRaw(owner, starting_index): same as tokensOfOwner
+        but returns a native list of the tokens' serialized data
+        instead of a serialized dictionary.
+    - tokensOfOwnerIter(owner): returns an iterator over the owner's
+        list of tokens; each value is a token's serialized data.
+        The tokensOfOwner variants leave out read/write data; use
+        rwProperties or token for it.
     - totalSupply(): Returns the total token supply deployed in the
         system.
     - transfer(to, token_id, extra_arg): transfers a token
@@ -101,6 +135,8 @@ def Main(operation, args):
         - mintToken(owner, properties, URI, extra_arg): create a new
             NFT token with the specified properties and URI and send it
             to the specified owner
+        - mintTokenBatch(tokens): mint several tokens at once; each
+            element is a list of mintToken arguments
         - modifyURI(token_id, token_data): modify specified token's
             URI data
 
@@ -129,161 +165,196 @@ def Main(operation, args):
         caller = GetCallingScriptHash()
         ctx = GetContext()
 
-        if operation == 'name':
-            name = Get(ctx, 'name')
-            if name:
-                return name
-            else:
-                return TOKEN_NAME
+        # Bucket the operations by their first character so each call
+        # only compares against the few names that share it; buckets
+        # are ordered by how often their operations are invoked
+        first = operation[0:1]
 
-        elif operation == 'symbol':
-            symbol = Get(ctx, 'symbol')
-            if symbol:
-                return symbol
-            else:
-                return TOKEN_SYMBOL
+        if first == 't':
+            if operation == 'transfer':
+                assert len(args) > 1, ARG_ERROR
+                return do_transfer(ctx, caller, args)
 
-        elif operation == 'supportedStandards':
-            supported_standards = Get(ctx, 'supportedStandards')
-            if supported_standards:
-                return supported_standards
-            else:
-                return Serialize(['NEP-10'])
-
-        elif operation == 'totalSupply':
-            return Get(ctx, TOKEN_CIRC_KEY)
-
-        elif operation == 'allowance':
-            assert len(args) == 1, ARG_ERROR
-            ownership = safe_deserialize(Get(ctx, concat('ownership/', args[0])))
-            assert ownership, TOKEN_DNE_ERROR
-            # don't fault here in case a calling contract is just checking allowance value
-            if not has_key(ownership, 'approved'): return False
-            if len(ownership['approved']) != 40: return False
-            return ownership['approved']
-
-        elif operation == 'balanceOf':
-            assert len(args) == 1, ARG_ERROR
-            assert len(args[0]) == 20, INVALID_ADDRESS_ERROR
-            token_iter = Find(ctx, args[0])
-            count = 0
-            while token_iter.next():
-                count += 1
-            return count
-
-        elif operation == 'ownerOf':
-            assert len(args) == 1, ARG_ERROR
-            ownership = safe_deserialize(Get(ctx, concat('ownership/', args[0])))
-            assert ownership, TOKEN_DNE_ERROR
-            assert has_key(ownership, 'owner'), TOKEN_DNE_ERROR
-            assert len(ownership['owner']) == 20, TOKEN_DNE_ERROR
-            return ownership['owner']
-
-        elif operation == 'properties':
-            assert len(args) == 1, ARG_ERROR
-            return get_properties(ctx, args[0])
-
-        elif operation == 'rwProperties':
-            assert len(args) == 1, ARG_ERROR
-            return get_rw_properties(ctx, args[0])
-
-        elif operation == 'token':
-            assert len(args) == 1, ARG_ERROR
-            token = Get(ctx, concat('token/', args[0]))
-            assert token, TOKEN_DNE_ERROR
-            return token
-
-        elif operation == 'tokensOfOwner':
-            assert len(args) == 2, ARG_ERROR
-            tokens_of_owner = do_tokens_of_owner(ctx, args[0], args[1])
-            assert tokens_of_owner, 'address has no tokens'
-            return Serialize(tokens_of_owner)
-
-        elif operation == 'uri':
-            assert len(args) == 1, ARG_ERROR
-            token = safe_deserialize(Get(ctx, concat('token/', args[0])))
-            assert token, TOKEN_DNE_ERROR
-            assert has_key(token, 'uri'), TOKEN_DNE_ERROR
-            return token['uri']
-
-        elif operation == 'decimals':
-            return TOKEN_DECIMALS
-
-        #
-        # User RW operations
-        #
-
-        if operation == 'approve':
-            # args: from, spender, id, revoke
-            # (NFT needs a fourth argument to revoke approval)
-            assert len(args) > 2, ARG_ERROR
-            assert args[2], TOKEN_DNE_ERROR 
-            return do_approve(ctx, caller, args)
-
-        elif operation == 'transfer':
-            assert len(args) > 1, ARG_ERROR
-            return do_transfer(ctx, caller, args)
-
-        elif operation == 'transferFrom':
-
-            assert len(args) > 2, ARG_ERROR
-            if len(args) == 3:
-                # Nash-style (from, to, amount/id) transferFrom that can 
-                # be invoked only by whitelisted DEX to initiate a 
-                # pre-approved transfer
-
-                return nash_do_transfer_from(ctx, caller, args)
-            else:
-                # Moonlight-style (spender, from, to, amount/id)
-                # transfer where an authenticated spender/originator is 
-                # the only one who can initiate a transfer but can send 
-                # to an arbitrary third party (or themselves)
+            elif operation == 'transferFrom':
+
+                assert len(args) > 2, ARG_ERROR
+                if len(args) == 3:
+                    # Nash-style (from, to, amount/id) transferFrom that can 
+                    # be invoked only by whitelisted DEX to initiate a 
+                    # pre-approved transfer
+
+                    return nash_do_transfer_from(ctx, caller, args)
+                else:
+                    # Moonlight-style (spender, from, to, amount/id)
+                    # transfer where an authenticated spender/originator is 
+                    # the only one who can initiate a transfer but can send 
+                    # to an arbitrary third party (or themselves)
+
+                    return do_transfer_from(ctx, caller, is_trusted_caller(ctx, caller), args)
+
+            elif operation == 'tokensOfOwner':
+                assert len(args) == 2, ARG_ERROR
+                tokens_of_owner = do_tokens_of_owner(ctx, args[0], args[1], False)
+                assert tokens_of_owner, 'address has no tokens'
+                return Serialize(tokens_of_owner)
+
+            elif operation == 'tokensOfOwnerRaw':
+                assert len(args) == 2, ARG_ERROR
+                tokens_of_owner = do_tokens_of_owner(ctx, args[0], args[1], True)
+                assert tokens_of_owner, 'address has no tokens'
+                return tokens_of_owner
+
+            elif operation == 'tokensOfOwnerIter':
+                # hand the storage iterator to the caller, who pulls as
+                # many entries as it needs instead of paging through
+                # start indexes
+                assert len(args) == 1, ARG_ERROR
+                assert len(args[0]) == 20, INVALID_ADDRESS_ERROR
+                return Find(ctx, concat(OWNERS_LIST_PREFIX, args[0]))
+
+            elif operation == 'token':
+                assert len(args) == 1, ARG_ERROR
+                assert is_valid_token_id(args[0]), TOKEN_DNE_ERROR
+                token = safe_deserialize(Get(ctx, concat(TOKEN_PREFIX, args[0])))
+                assert token, TOKEN_DNE_ERROR
+                # read/write data lives under its own key
+                token['rwproperties'] = Get(ctx, concat(RW_PROPERTIES_PREFIX, args[0]))
+                return Serialize(token)
+
+            elif operation == 'totalSupply':
+                return Get(ctx, TOKEN_CIRC_KEY)
+
+        elif first == 'b':
+            if operation == 'balanceOf':
+                assert len(args) == 1, ARG_ERROR
+                assert len(args[0]) == 20, INVALID_ADDRESS_ERROR
+                return Get(ctx, concat(BALANCE_PREFIX, args[0]))
+
+        elif first == 'o':
+            if operation == 'ownerOf':
+                assert len(args) == 1, ARG_ERROR
+                assert is_valid_token_id(args[0]), TOKEN_DNE_ERROR
+                ownership = Get(ctx, concat(OWNERSHIP_PREFIX, args[0]))
+                assert len(ownership) >= 20, TOKEN_DNE_ERROR
+                return ownership[0:20]
 
-                return do_transfer_from(ctx, caller, args)
+        elif first == 'a':
+            if operation == 'allowance':
+                assert len(args) == 1, ARG_ERROR
+                assert is_valid_token_id(args[0]), TOKEN_DNE_ERROR
+                ownership = Get(ctx, concat(OWNERSHIP_PREFIX, args[0]))
+                assert ownership, TOKEN_DNE_ERROR
+                # don't fault here in case a calling contract is just checking allowance value
+                if len(ownership) != 40: return False
+                # an approved record is already owner + spender
+                return ownership
+
+            elif operation == 'approve':
+                # args: from, spender, id, revoke
+                # (NFT needs a fourth argument to revoke approval)
+                assert len(args) > 2, ARG_ERROR
+                assert args[2], TOKEN_DNE_ERROR 
+                return do_approve(ctx, caller, is_trusted_caller(ctx, caller), args)
+
+        elif first == 'u':
+            if operation == 'uri':
+                assert len(args) == 1, ARG_ERROR
+                assert is_valid_token_id(args[0]), TOKEN_DNE_ERROR
+                token = safe_deserialize(Get(ctx, concat(TOKEN_PREFIX, args[0])))
+                assert token, TOKEN_DNE_ERROR
+                assert has_key(token, 'uri'), TOKEN_DNE_ERROR
+                return token['uri']
+
+        elif first == 'p':
+            if operation == 'properties':
+                assert len(args) == 1, ARG_ERROR
+                return get_properties(ctx, args[0])
 
-        #
-        # dApp operations
-        #
-        if operation == 'setRWProperties':
-            # args: token id, rwdata
-            assert CheckWitness(DAPP_ADMIN), PERMISSION_ERROR
-            assert len(args) == 2, ARG_ERROR
-            return set_rw_properties(ctx, args[0], args[1])
+        elif first == 'r':
+            if operation == 'rwProperties':
+                assert len(args) == 1, ARG_ERROR
+                return get_rw_properties(ctx, args[0])
+
+        elif first == 'n':
+            if operation == 'name':
+                name = Get(ctx, NAME_KEY)
+                if name:
+                    return name
+                else:
+                    return TOKEN_NAME
+
+        elif first == 's':
+            if operation == 'symbol':
+                symbol = Get(ctx, SYMBOL_KEY)
+                if symbol:
+                    return symbol
+                else:
+                    return TOKEN_SYMBOL
+
+            elif operation == 'supportedStandards':
+                supported_standards = Get(ctx, SUPPORTED_STANDARDS_KEY)
+                if supported_standards:
+                    return supported_standards
+                else:
+                    return Serialize(['NEP-10'])
+
+            elif operation == 'setRWProperties':
+                # dApp operation
+                # args: token id, rwdata
+                assert CheckWitness(DAPP_ADMIN), PERMISSION_ERROR
+                assert len(args) == 2, ARG_ERROR
+                return set_rw_properties(ctx, args[0], args[1])
 
+        elif first == 'd':
+            if operation == 'decimals':
+                return TOKEN_DECIMALS
 
         # Administrative operations
-        if CheckWitness(TOKEN_CONTRACT_OWNER):
+        # (only pay for the witness check when an admin operation was
+        # actually requested)
+        if (operation == 'mintToken' or operation == 'mintTokenBatch' or
+                operation == 'modifyURI' or operation == 'setName' or
+                operation == 'setSymbol' or
+                operation == 'setSupportedStandards'):
+            assert CheckWitness(TOKEN_CONTRACT_OWNER), PERMISSION_ERROR
+
             if operation == 'mintToken':
                 assert len(args) > 3, ARG_ERROR
                 return do_mint_token(ctx, args)
 
+            elif operation == 'mintTokenBatch':
+                assert len(args) > 0, ARG_ERROR
+                return do_mint_token_batch(ctx, args)
+
             elif operation == 'modifyURI':
                 assert len(args) == 2, ARG_ERROR
                 return do_modify_uri(ctx, args) 
 
             elif operation == 'setName':
                 assert len(args) == 1, ARG_ERROR
-                return do_set_config(ctx, 'name', args[0])
+                return do_set_config(ctx, NAME_KEY, args[0])
 
             elif operation == 'setSymbol':
                 assert len(args) == 1, ARG_ERROR
-                return do_set_config(ctx, 'symbol', args[0])
+                return do_set_config(ctx, SYMBOL_KEY, args[0])
 
             elif operation == 'setSupportedStandards':
                 assert len(args) >= 1, ARG_ERROR
                 supported_standards = ['NEP-10']
                 for arg in args:
                     supported_standards.append(arg)
-                return do_set_config(ctx, 'supportedStandards', Serialize(supported_standards))
+                return do_set_config(ctx, SUPPORTED_STANDARDS_KEY, Serialize(supported_standards))
 
         AssertionError('unknown operation')
     return False
 
 
-def do_approve(ctx, Caller, args):
+def do_approve(ctx, Caller, caller_trusted, args):
     """Approve a token to be transferred to a third party by an approved spender
 
     :param StorageContext ctx: current store context
+    :param bool caller_trusted: caller is the entry script or a
+        whitelisted DEX
     :param bytearray t_owner: current owner of the token
     :param bytearray t_spender: spender to approve
     :param int t_id: int: token id
@@ -299,40 +370,39 @@ def do_approve(ctx, Caller, args):
     if len(args) > 3:
         revoke = args[3] 
     
-    if Caller != GetEntryScriptHash() and not is_whitelisted_dex(ctx, Caller):
+    if not caller_trusted:
         # non-whitelisted contracts can only approve their own funds for transfer,
         # even if they have the signature of the owner on the invocation 
         t_owner = Caller
 
     assert len(t_owner) == 20, INVALID_ADDRESS_ERROR
     assert len(t_spender) == 20, INVALID_ADDRESS_ERROR
-    assert t_id, TOKEN_DNE_ERROR
+    assert is_valid_token_id(t_id), TOKEN_DNE_ERROR
 
-    ownership_key = concat('ownership/', t_id)
-    ownership = safe_deserialize(Get(ctx, ownership_key))
+    ownership_key = concat(OWNERSHIP_PREFIX, t_id)
+    ownership = Get(ctx, ownership_key)
 
     assert ownership, TOKEN_DNE_ERROR
-    assert has_key(ownership, 'owner'), TOKEN_DNE_ERROR
-    assert t_owner == ownership['owner'], PERMISSION_ERROR
+    assert t_owner == ownership[0:20], PERMISSION_ERROR
     assert t_owner != t_spender, 'same owner and spender'
     assert authenticate(t_owner, Caller), PERMISSION_ERROR
 
     # revoke previous approval if revoke is True
     if revoke:
-        if has_key(ownership, 'approved'):
-            ownership.remove('approved')
-            Put(ctx, ownership_key, Serialize(ownership))
+        if len(ownership) > 20:
+            Put(ctx, ownership_key, t_owner)
 
         # log the revoking of previous approvals
-        OnApprove(t_owner, t_spender, 0)
+        if EMIT_LEGACY_EVENTS:
+            OnApprove(t_owner, t_spender, 0)
         OnNFTApprove(t_owner, '', t_id)
         return True
 
-    ownership['approved'] = concat(t_owner, t_spender)
     # approve this transfer
-    Put(ctx, ownership_key, Serialize(ownership))
+    Put(ctx, ownership_key, concat(t_owner, t_spender))
     # Log this approval event
-    OnApprove(t_owner, t_spender, 1)
+    if EMIT_LEGACY_EVENTS:
+        OnApprove(t_owner, t_spender, 1)
     OnNFTApprove(t_owner, t_spender, t_id)
     return True
 
@@ -350,45 +420,34 @@ def do_mint_token(ctx, args):
     :return: mint success
     :rtype: bool
     """
+    store_new_token(ctx, args)
 
+    # read the supply only once the mint is known to succeed
     t_circ = Get(ctx, TOKEN_CIRC_KEY)
     t_circ += 1
+    Put(ctx, TOKEN_CIRC_KEY, t_circ)  # update total supply
+    return True
 
-    assert len(args[0]) == 20, INVALID_ADDRESS_ERROR
-    assert args[1], 'missing token id'
-    assert args[2], 'missing properties'
-    assert args[3], 'missing uri'
-
-    t_id = args[1]
-    token = safe_deserialize(Get(ctx, concat('token/', t_id)))
-    assert not token, 'token already exists'
-
-    # basically a token 'object' containing the token's
-    # id, uri, and properties
-    token = {}
-    ownership = {}  # information about the token's owner
-
-    token['id'] = t_id
-    token['uri'] = args[3]
-    token['properties'] = args[2] # this can never change
 
-    if len(args) > 4:
-        token['rwproperties'] = args[4]
-    else:
-        token['rwproperties'] = ''
+def do_mint_token_batch(ctx, args):
+    """Mints several NFT tokens, updating the totalSupply once for the
+    whole batch
 
-    ownership['owner'] = args[0]
+    :param StorageContext ctx: current store context
+    :param list args: one list per token, laid out like the mintToken
+        arguments
+    :return: mint success
+    :rtype: bool
+    """
+    count = 0
+    for token_args in args:
+        assert len(token_args) > 3, ARG_ERROR
+        store_new_token(ctx, token_args)
+        count += 1
 
-    Put(ctx, concat('token/', t_id), Serialize(token))
-    # update token's owner
-    Put(ctx, concat('ownership/', t_id), Serialize(ownership))
-    res = add_token_to_owners_list(ctx, ownership['owner'], t_id)
+    t_circ = Get(ctx, TOKEN_CIRC_KEY)
+    t_circ += count
     Put(ctx, TOKEN_CIRC_KEY, t_circ)  # update total supply
-    # Log this minting event
-    OnTransfer('', ownership['owner'], 1)
-    OnNFTTransfer('', ownership['owner'], t_id)
-    OnMint(ownership['owner'], 1)
-    OnNFTMint(ownership['owner'], t_id)
     return True
 
 
@@ -405,16 +464,18 @@ def do_modify_uri(ctx, args):
     t_id = args[0]
     t_uri = args[1]
 
-    token_key = concat('token/', t_id)
+    token_key = concat(TOKEN_PREFIX, t_id)
     token = safe_deserialize(Get(ctx, token_key))
     assert token, TOKEN_DNE_ERROR
 
     token['uri'] = t_uri
-    Put(ctx, token_key, Serialize(token))
+    token_data = Serialize(token)
+    Put(ctx, token_key, token_data)
+    update_owners_list_entry(ctx, t_id, token_data)
     return True
 
 
-def do_tokens_of_owner(ctx, t_owner, start_id):
+def do_tokens_of_owner(ctx, t_owner, start_id, as_list):
     """This method returns ten of the owner's tokens starting at the
     given index. The index is used for paginating through the results.
     Pagination is needed for the situation where the owner's dict of
@@ -424,9 +485,11 @@ def do_tokens_of_owner(ctx, t_owner, start_id):
     :param bytearray t_owner: token owner
     :param int start_id: the id to start searching through the
         owner's tokens
-    :return: dictionary of id, properties, and uri keys mapped to their
-        corresponding token's data
-    :rtype: bool or dict
+    :param bool as_list: return a list of token data instead of a
+        dictionary (each token's data already contains its id)
+    :return: dictionary of token ids mapped to their corresponding
+        token's serialized data, or a list of the serialized data
+    :rtype: bool or dict or list
     """
 
     assert len(t_owner) == 20, INVALID_ADDRESS_ERROR 
@@ -434,14 +497,19 @@ def do_tokens_of_owner(ctx, t_owner, start_id):
     if start_id == 0:
         start_id = 1  # token id's cannot go below 1
 
-    start_key = concat(t_owner, start_id)
+    owner_key = concat(OWNERS_LIST_PREFIX, t_owner)
+    start_key = concat(owner_key, start_id)
     count = 0
-    token_dict = {}
-    token_iter = Find(ctx, t_owner)
+    if as_list:
+        tokens = []
+    else:
+        tokens = {}
+    token_iter = Find(ctx, owner_key)
 
     # while loop explained: keep looping through the owner's list
     # of tokens until 10 have been found beginning at the starting
-    # index.
+    # index. The count is tested first so the iterator is not
+    # advanced again once the page is full.
     # if statement explained: once a key has been found matching
     # my search key (or of greater value),
     # update the dictionary, increment the counter,
@@ -449,14 +517,17 @@ def do_tokens_of_owner(ctx, t_owner, start_id):
     # (once a key has been found matching my search key
     # (or greater), just get everything afterward while count < 10)
 
-    while token_iter.next() and (count < 10):
-        if (token_iter.Key >= start_key) or (count > 0):
-            token_key = concat('token/', token_iter.Value)
-            token = safe_deserialize(Get(ctx, token_key))
-            if token:
-                token_dict[token_key] = token
-                count += 1
-    return token_dict
+    while (count < 10) and token_iter.next():
+        t_key = token_iter.Key
+        if (t_key >= start_key) or (count > 0):
+            # the owner's list holds a serialized copy of each token's
+            # record; hand it back as is rather than round-tripping it
+            if as_list:
+                tokens.append(token_iter.Value)
+            else:
+                tokens[t_key[21:len(t_key)]] = token_iter.Value
+            count += 1
+    return tokens
 
 
 def do_transfer(ctx, Caller, args):
@@ -471,52 +542,47 @@ def do_transfer(ctx, Caller, args):
     :rtype: bool
     """
     # we don't need the t_from because the token data stores the owner
-    t_from = ""
     t_to = args[0]
     t_id = args[1]
 
     if len(args) == 3:  # use traditional from, to, id format if they want to send it
-        t_from = args[0]
         t_to = args[1]
         t_id = args[2]
 
-    if Caller != GetEntryScriptHash() and not is_whitelisted_dex(ctx, Caller):
-        # non-whitelisted contracts can only approve their own funds for transfer,
-        # even if they have the signature of the owner on the invocation 
-        t_from = Caller
+    assert len(t_to) == 20, INVALID_ADDRESS_ERROR
+    assert is_valid_token_id(t_id), TOKEN_DNE_ERROR
 
-    assert len(t_to) == 20, INVALID_ADDRESS_ERROR 
-    ownership = safe_deserialize(Get(ctx, concat('ownership/', t_id)))
+    # a self-transfer is only a no-op for the token's real owner, so it
+    # can't be answered before the ownership read
+    ownership_key = concat(OWNERSHIP_PREFIX, t_id)
+    ownership = Get(ctx, ownership_key)
 
     assert ownership, TOKEN_DNE_ERROR
-    assert has_key(ownership, 'owner'), TOKEN_DNE_ERROR
-    assert len(ownership['owner']) == 20, TOKEN_DNE_ERROR
 
-    t_owner = ownership['owner']
+    # every owner write is length-checked, so the stored owner is valid
+    t_owner = ownership[0:20]
 
     if t_owner == t_to:
-        print('transfer to self')
+        if DEBUG:
+            print('transfer to self')
         return True
 
     assert authenticate(t_owner, Caller), PERMISSION_ERROR
 
-    res = remove_token_from_owners_list(ctx, t_owner, t_id)
-    assert res, 'unable to remove token from owner list'
-   
-    ownership['owner'] = t_to  # update token's owner
-    # remove any existing approvals for this token
-    if has_key(ownership, 'approved'):
-        ownership.remove('approved')
+    token_data = remove_token_from_owners_list(ctx, t_owner, t_id)
+    assert token_data, 'unable to remove token from owner list'
 
-    Put(ctx, concat('ownership/', t_id), Serialize(ownership))
-    res = add_token_to_owners_list(ctx, t_to, t_id)
+    # update token's owner, which also drops any existing approval
+    Put(ctx, ownership_key, t_to)
+    res = add_token_to_owners_list(ctx, t_to, t_id, token_data)
 
     # log this transfer event
-    OnTransfer(t_owner, t_to, 1)
+    if EMIT_LEGACY_EVENTS:
+        OnTransfer(t_owner, t_to, 1)
     OnNFTTransfer(t_owner, t_to, t_id)
     return True
 
-def do_transfer_from(ctx, Caller, args):
+def do_transfer_from(ctx, Caller, caller_trusted, args):
     """Transfers the approved token at the specified id from the
     t_from address to the t_to address
 
@@ -524,6 +590,8 @@ def do_transfer_from(ctx, Caller, args):
     and a whitelisted DEX will still need to pass the authentication of the spender
 
     :param StorageContext ctx: current store context
+    :param bool caller_trusted: caller is the entry script or a
+        whitelisted DEX
     :param list args:
         0: bytearray t_spender: approved spender address
         1: bytearray t_from: transfer from address (token owner)
@@ -538,7 +606,7 @@ def do_transfer_from(ctx, Caller, args):
     t_to = args[2]
     t_id = args[3]
 
-    if Caller != GetEntryScriptHash() and not is_whitelisted_dex(ctx, Caller):
+    if not caller_trusted:
         # non-whitelisted contracts can only approve their own funds for transfer,
         # even if they have the signature of the owner on the invocation 
         t_from = Caller
@@ -546,36 +614,37 @@ def do_transfer_from(ctx, Caller, args):
     assert len(t_spender) == 20, INVALID_ADDRESS_ERROR 
     assert len(t_from) == 20, INVALID_ADDRESS_ERROR 
     assert len(t_to) == 20, INVALID_ADDRESS_ERROR 
+    assert is_valid_token_id(t_id), TOKEN_DNE_ERROR
     assert authenticate(t_spender, Caller), PERMISSION_ERROR
 
     if t_from == t_to:
-        print('transfer to self')
+        if DEBUG:
+            print('transfer to self')
         return True
 
-    ownership = safe_deserialize(Get(ctx, concat('ownership/', t_id)))
+    ownership_key = concat(OWNERSHIP_PREFIX, t_id)
+    ownership = Get(ctx, ownership_key)
     assert ownership, TOKEN_DNE_ERROR
-    assert has_key(ownership, 'owner'), TOKEN_DNE_ERROR
-    assert has_key(ownership, 'approved'), 'no approval exists for this token'
-    assert len(ownership['owner']) == 20, TOKEN_DNE_ERROR
+    assert len(ownership) == 40, 'no approval exists for this token'
 
-    t_owner = ownership['owner']
+    t_owner = ownership[0:20]
 
     assert t_from == t_owner, 'from address is not the owner of this token'
-    assert len(ownership['approved']) == 40, 'malformed approval key for this token'
 
     # Finally check to see if the owner approved this spender
-    assert ownership['approved'] == concat(t_from, t_spender), PERMISSION_ERROR
+    # (the approval only records the spender; the owner was matched
+    # against t_from above)
+    assert ownership[20:40] == t_spender, PERMISSION_ERROR
 
-    res = remove_token_from_owners_list(ctx, t_from, t_id)
-    assert res, 'unable to remove token from owner list'
+    token_data = remove_token_from_owners_list(ctx, t_from, t_id)
+    assert token_data, 'unable to remove token from owner list'
 
-    ownership['owner'] = t_to
-    ownership.remove('approved')  # remove previous approval
-    Put(ctx, concat('ownership/', t_id), Serialize(ownership))
-    res = add_token_to_owners_list(ctx, t_to, t_id)
+    Put(ctx, ownership_key, t_to)  # new owner, previous approval removed
+    res = add_token_to_owners_list(ctx, t_to, t_id, token_data)
 
     # log this transfer event
-    OnTransfer(t_from, t_to, 1)
+    if EMIT_LEGACY_EVENTS:
+        OnTransfer(t_from, t_to, 1)
     OnNFTTransfer(t_from, t_to, t_id)
     return True
 
@@ -602,34 +671,33 @@ def nash_do_transfer_from(ctx, Caller, args):
     assert is_whitelisted_dex(ctx, Caller), PERMISSION_ERROR
     assert len(t_from) == 20, INVALID_ADDRESS_ERROR 
     assert len(t_to) == 20, INVALID_ADDRESS_ERROR 
+    assert is_valid_token_id(t_id), TOKEN_DNE_ERROR
             
     if t_from == t_to:
-        print('transfer to self')
+        if DEBUG:
+            print('transfer to self')
         return True
 
-    ownership = safe_deserialize(Get(ctx, concat('ownership/', t_id)))
+    ownership_key = concat(OWNERSHIP_PREFIX, t_id)
+    ownership = Get(ctx, ownership_key)
     assert ownership, TOKEN_DNE_ERROR
-    assert has_key(ownership, 'owner'), TOKEN_DNE_ERROR
-    assert has_key(ownership, 'approved'), 'no approval exists for this token'
-    assert len(ownership['owner']) == 20, TOKEN_DNE_ERROR
+    assert len(ownership) == 40, 'no approval exists for this token'
 
-    t_owner = ownership['owner']
+    t_owner = ownership[0:20]
 
     assert t_from == t_owner, 'from address is not the owner of this token'
-    assert len(ownership['approved']) == 40, 'malformed approval key for this token'
 
-    assert ownership['approved'] == concat(t_from, t_to), PERMISSION_ERROR
+    assert ownership[20:40] == t_to, PERMISSION_ERROR
 
-    res = remove_token_from_owners_list(ctx, t_from, t_id)
-    assert res, 'unable to remove token from owner list'
+    token_data = remove_token_from_owners_list(ctx, t_from, t_id)
+    assert token_data, 'unable to remove token from owner list'
 
-    ownership['owner'] = t_to
-    ownership.remove('approved')  # remove previous approval
-    Put(ctx, concat('ownership/', t_id), Serialize(ownership))
-    res = add_token_to_owners_list(ctx, t_to, t_id)
+    Put(ctx, ownership_key, t_to)  # new owner, previous approval removed
+    res = add_token_to_owners_list(ctx, t_to, t_id, token_data)
 
     # log this transfer event
-    OnTransfer(t_from, t_to, 1)
+    if EMIT_LEGACY_EVENTS:
+        OnTransfer(t_from, t_to, 1)
     OnNFTTransfer(t_from, t_to, t_id)
     return True
 
@@ -646,14 +714,66 @@ def do_set_config(ctx, key, value):
     """
     if len(value) > 0:
         Put(ctx, key, value)
-        print('config key set')
     else:
         Delete(ctx, key)
-        print('config key deleted')
 
     return True
 
 
+def store_new_token(ctx, args):
+    """Stores a new token's properties, URI info, and owner and logs
+    the mint; the caller updates the totalSupply
+
+    :param StorageContext ctx: current store context
+    :param list args:
+        0: bytearray t_owner: token owner
+        1: int t_id: token id (must not already exist)
+        2: str t_properties: token's read only data
+        3: str t_uri: token's uri
+        4: str t_rw_properties: token's read/write data (optional)
+    :return: none
+    """
+    assert len(args[0]) == 20, INVALID_ADDRESS_ERROR
+    assert args[1], 'missing token id'
+    assert len(args[1]) <= TOKEN_ID_MAX_LENGTH, 'token id too long'
+    assert args[2], 'missing properties'
+    assert args[3], 'missing uri'
+
+    t_id = args[1]
+    token_key = concat(TOKEN_PREFIX, t_id)
+    # existence check only; no need to deserialize the record
+    assert not Get(ctx, token_key), 'token already exists'
+
+    # basically a token 'object' containing the token's
+    # id, uri, and properties
+    token = {}
+    t_owner = args[0]
+
+    token['id'] = t_id
+    token['uri'] = args[3]
+    token['properties'] = args[2] # this can never change
+
+    # both kinds of properties also live under their own keys, so the
+    # getters are a single Get and setRWProperties never has to rewrite
+    # the token record
+    Put(ctx, concat(PROPERTIES_PREFIX, t_id), args[2])
+    if len(args) > 4:
+        Put(ctx, concat(RW_PROPERTIES_PREFIX, t_id), args[4])
+
+    token_data = Serialize(token)
+    Put(ctx, token_key, token_data)
+    # update token's owner
+    Put(ctx, concat(OWNERSHIP_PREFIX, t_id), t_owner)
+    res = add_token_to_owners_list(ctx, t_owner, t_id, token_data)
+    # Log this minting event
+    if EMIT_LEGACY_EVENTS:
+        OnTransfer('', t_owner, 1)
+    OnNFTTransfer('', t_owner, t_id)
+    if EMIT_LEGACY_EVENTS:
+        OnMint(t_owner, 1)
+    OnNFTMint(t_owner, t_id)
+
+
 def safe_deserialize(data):
     """Checks to see if the data exists before attempting to
     deserialize it
@@ -669,81 +789,153 @@ def safe_deserialize(data):
     return False
 
 
-def add_token_to_owners_list(ctx, t_owner, t_id):
+def add_token_to_owners_list(ctx, t_owner, t_id, token_data):
     """Adds a token to the owner's list of tokens
 
+    The list is keyed by ``OWNERS_LIST_PREFIX + owner + token id``
+    rather than by a dense slot number, so a token's entry can always
+    be located directly without scanning the owner's key range or
+    keeping a reverse index, and a Find on the tag plus the owner only
+    ever returns this list.
+    Each entry holds a copy of the token's serialized record so the
+    list can be read without a further lookup per token, and the
+    owner's token count is kept alongside for balanceOf.
+
     :param StorageContext ctx: current store context
     :param bytearray t_owner: token owner (could be either a smart
         contract or a wallet address)
     :param int t_id: token ID
+    :param bytearray token_data: the token's serialized record
     :return: none
     """
-    Put(ctx, concat(t_owner, t_id), t_id)  # store owner's new token
+    Put(ctx, concat(concat(OWNERS_LIST_PREFIX, t_owner), t_id), token_data)  # store owner's new token
+    balance_key = concat(BALANCE_PREFIX, t_owner)
+    Put(ctx, balance_key, Get(ctx, balance_key) + 1)
     return True
 
 
 def remove_token_from_owners_list(ctx, t_owner, t_id):
     """Removes a token from owner's list of tokens
 
+    This is a single lookup on the ``OWNERS_LIST_PREFIX + owner +
+    token id`` key, no matter how many tokens the owner holds.
+
     :param StorageContext ctx: current store context
     :param bytearray t_owner: token owner
     :param int t_id: token id
-    :return: successfully removed token from owner's list
-    :rtype: bool
+    :return: the removed entry's serialized token record, or False if
+        the token was not in the owner's list
+    :rtype: bool or bytearray
     """
-    ckey = concat(t_owner, t_id)
-    if Get(ctx, ckey):
+    ckey = concat(concat(OWNERS_LIST_PREFIX, t_owner), t_id)
+    token_data = Get(ctx, ckey)
+    if token_data:
         Delete(ctx, ckey)
-        return True
+        balance_key = concat(BALANCE_PREFIX, t_owner)
+        balance = Get(ctx, balance_key) - 1
+        if balance > 0:
+            Put(ctx, balance_key, balance)
+        else:
+            Delete(ctx, balance_key)
+        return token_data
 
     print("token not found in owner's list")
     return False
 
 
+def update_owners_list_entry(ctx, t_id, token_data):
+    """Refreshes the copy of a token's record kept in its owner's list
+
+    :param StorageContext ctx: current store context
+    :param int t_id: token id
+    :param bytearray token_data: the token's new serialized record
+    :return: none
+    """
+    ownership = Get(ctx, concat(OWNERSHIP_PREFIX, t_id))
+    if ownership:
+        Put(ctx, concat(concat(OWNERS_LIST_PREFIX, ownership[0:20]), t_id), token_data)
+
+
 def get_properties(ctx, id):
-    token = safe_deserialize(Get(ctx, concat('token/', id)))
-    if not token:  
+    if not is_valid_token_id(id):
         print(TOKEN_DNE_ERROR)
         return False
-    if not has_key(token, 'properties'):
+    properties = Get(ctx, concat(PROPERTIES_PREFIX, id))
+    if not properties:
+        print(TOKEN_DNE_ERROR)
         return False
-    return token['properties']
+    return properties
 
 
 def get_rw_properties(ctx, id):
-    token = safe_deserialize(Get(ctx, concat('token/', id)))
-    if not token:  
+    if not is_valid_token_id(id):
         print(TOKEN_DNE_ERROR)
         return False
-    if not has_key(token, 'rwproperties'):
+    # the ownership record is the smallest read that proves the token exists
+    if not Get(ctx, concat(OWNERSHIP_PREFIX, id)):
+        print(TOKEN_DNE_ERROR)
         return False
-    return token['rwproperties']
+    return Get(ctx, concat(RW_PROPERTIES_PREFIX, id))
 
 
 def set_rw_properties(ctx, id, data):
-    token_key = concat('token/', id)
-    token = safe_deserialize(Get(ctx, token_key ))
-
-    if not token:
+    if not is_valid_token_id(id):
+        print(TOKEN_DNE_ERROR)
+        return False
+    # the ownership record is the smallest read that proves the token exists
+    if not Get(ctx, concat(OWNERSHIP_PREFIX, id)):
         print(TOKEN_DNE_ERROR)
         return False
-    token['rwproperties'] = data
-    Put(ctx, token_key, Serialize(token))
+    Put(ctx, concat(RW_PROPERTIES_PREFIX, id), data)
+    return True
+
+
+def is_valid_token_id(t_id):
+    """Checks that a token id could have been minted, so lookups of
+    malformed ids can be rejected without a storage read
+
+    :param int t_id: token id
+    :return: whether the id has a mintable length
+    :rtype: bool
+    """
+    if len(t_id) == 0: return False
+    if len(t_id) > TOKEN_ID_MAX_LENGTH: return False
     return True
 
 
 def authenticate(scripthash, Caller):
+    # the byte compare is free, so only a calling contract pays for
+    # GetContract and only everyone else pays for CheckWitness
+    if scripthash == Caller:
+        if GetContract(scripthash): return True
     if CheckWitness(scripthash): return True
-    if GetContract(scripthash) and scripthash == Caller: return True
     return False
 
 
 def do_whitelist_dex(ctx, args):
-    return do_set_config(ctx, concat('exchange/', args[0]), args[1])
+    # store a one-byte flag so is_whitelisted_dex reads as little as
+    # possible, whatever value the caller passed in
+    if args[1]:
+        return do_set_config(ctx, concat(EXCHANGE_PREFIX, args[0]), b'\x01')
+    return do_set_config(ctx, concat(EXCHANGE_PREFIX, args[0]), b'')
 
 
 def is_whitelisted_dex(ctx, scripthash):
-    return Get(ctx, concat('exchange/', scripthash))
+    return Get(ctx, concat(EXCHANGE_PREFIX, scripthash))
+
+
+def is_trusted_caller(ctx, Caller):
+    """Checks whether the caller may act on behalf of the addresses it
+    passes in, i.e. it is the entry script or a whitelisted DEX
+
+    :param StorageContext ctx: current store context
+    :param bytearray Caller: calling script hash
+    :return: whether the caller is trusted
+    :rtype: bool
+    """
+    if Caller == GetEntryScriptHash(): return True
+    if is_whitelisted_dex(ctx, Caller): return True
+    return False
 
 
 def AssertionError(msg):
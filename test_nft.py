@@ -2,6 +2,7 @@
 # python3 -m unittest test_nft.py
 
 from boa_test.tests.boa_test import BoaFixtureTest
+import boa
 from boa.compiler import Compiler
 from neo.Core.TX.Transaction import Transaction
 from neo.Prompt.Commands.BuildNRun import TestBuild
@@ -13,150 +14,271 @@ from neo.Core.FunctionCode import FunctionCode
 from neocore.Fixed8 import Fixed8
 from nft_template import *
 
+import hashlib
 import shutil
 import os
-from logzero import logger
+import tempfile
+from collections import deque
 
 settings.USE_DEBUG_STORAGE = True
-settings.DEBUG_STORAGE_PATH = './fixtures/debugstorage'
 settings.log_smart_contract_events = True
 settings.emit_notify_events_on_sc_execution_error = True
 
+_OWNER_BA = bytearray(TOKEN_CONTRACT_OWNER)
+
+# invocation parameters that don't depend on the fixture wallets
+_MINT_1_PARAMS = parse_param([_OWNER_BA, 1, 'token1ROData', 'https://example.com/images/1.png', 'token1ROData'])
+_MINT_2_PARAMS = parse_param([_OWNER_BA, 2, 'token2ROData', 'https://example.com/images/2.png', 'token2ROData'])
+_OWNER_PARAMS = parse_param([_OWNER_BA])
+_OWNER_TOKENS_PARAMS = parse_param([_OWNER_BA, 0])
+_TOKEN_1_PARAMS = parse_param([1])
+_LONG_TOKEN_ID = 'x' * (TOKEN_ID_MAX_LENGTH + 1)
+_LONG_TOKEN_ID_PARAMS = parse_param([_LONG_TOKEN_ID])
+_BAD_ADDRESS_PARAMS = parse_param(['abc'])
+_NO_PARAMS = parse_param([])
+_TOKEN_2_PARAMS = parse_param([2])
+_BATCH_MINT_PARAMS = parse_param([
+    [_OWNER_BA, 3, 'token3ROData', 'https://example.com/images/3.png'],
+    [_OWNER_BA, 4, 'token4ROData', 'https://example.com/images/4.png', 'token4RWData']])
+_MISSING_TOKEN_PARAMS = parse_param([999999])
+
+
+def _compile_cached(path):
+    """Compiles a contract, reusing the bytecode from an earlier run when
+    neither the source nor the neo-boa version has changed since"""
+    digest = hashlib.sha256(boa.__version__.encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read())
+    cache_dir = os.path.join(tempfile.gettempdir(), 'nft-template-avm')
+    prefix = os.path.basename(path) + '.'
+    cache = os.path.join(cache_dir, prefix + digest.hexdigest() + '.avm')
+    if os.path.exists(cache):
+        with open(cache, 'rb') as f:
+            return f.read()
+    out = Compiler.instance().load(path).default.write()
+    os.makedirs(cache_dir, exist_ok=True)
+    # only the latest build of each contract is worth keeping
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix):
+            os.remove(os.path.join(cache_dir, name))
+    with open(cache, 'wb') as f:
+        f.write(out)
+    return out
+
+
+def _read_varint(data, i):
+    size = data[i]
+    if size < 0xfd:
+        return size, i + 1
+    width = {0xfd: 2, 0xfe: 4, 0xff: 8}[size]
+    return int.from_bytes(data[i + 1:i + 1 + width], 'little'), i + 1 + width
+
+
+def _read_item(data, i):
+    kind = data[i]
+    i += 1
+    if kind == 0x01:  # boolean
+        return data[i] != 0, i + 1
+    if kind in (0x00, 0x02):  # byte array, integer
+        size, i = _read_varint(data, i)
+        return data[i:i + size], i + size
+    count, i = _read_varint(data, i)
+    if kind == 0x82:  # map
+        value = {}
+        for _ in range(count):
+            key, i = _read_item(data, i)
+            value[key], i = _read_item(data, i)
+        return value, i
+    value = []  # array, struct
+    for _ in range(count):
+        item, i = _read_item(data, i)
+        value.append(item)
+    return value, i
+
+
+def _deserialize(data):
+    """Decodes a value written by the contract's Runtime.Serialize"""
+    return _read_item(bytes(data), 0)[0]
+
+
+# tests that assert on dispatched events
+_EVENT_TESTS = ('test_NFT_2', 'test_NFT_3_mint', 'test_NFT_4_approval')
+
 
 class TestContract(BoaFixtureTest):
 
-    dispatched_events = []
-    dispatched_logs = []
+    dispatched_events = deque(maxlen=128)
+    dispatched_logs = deque(maxlen=128)
 
     @classmethod
     def tearDownClass(cls):
         super(BoaFixtureTest, cls).tearDownClass()
-        try:
-            if os.path.exists(settings.debug_storage_leveldb_path):
-
-                shutil.rmtree(settings.debug_storage_leveldb_path)
-            else:
-                logger.error("debug storage path doesn't exist")
-        except Exception as e:
-            logger.error("couldn't remove debug storage %s " % e)
+        shutil.rmtree(cls._dbg_path, ignore_errors=True)
 
     @classmethod
     def setUpClass(cls):
+        # a fresh directory per run, so nothing needs checking on teardown
+        cls._dbg_path = tempfile.mkdtemp(prefix='nftdbg_')
+        settings.DEBUG_STORAGE_PATH = cls._dbg_path
         super(TestContract, cls).setUpClass()
 
-        def on_notif(evt):
-            print(evt)
-            cls.dispatched_events.append(evt)
-            print("dispatched events %s " % cls.dispatched_events)
+        # the contract source doesn't change between tests, so compile it once
+        cls._out = _compile_cached('nft_template.py')
+
+    def setUp(self):
+        # only the tests that inspect events pay for collecting them
+        self._subscribed = self._testMethodName in _EVENT_TESTS
+        if self._subscribed:
+            events.on(SmartContractEvent.RUNTIME_NOTIFY, self._on_notif)
+            events.on(SmartContractEvent.RUNTIME_LOG, self._on_log)
+
+    def tearDown(self):
+        if self._subscribed:
+            events.off(SmartContractEvent.RUNTIME_NOTIFY, self._on_notif)
+            events.off(SmartContractEvent.RUNTIME_LOG, self._on_log)
+
+    def _on_notif(self, evt):
+        TestContract.dispatched_events.append(evt)
+
+    def _on_log(self, evt):
+        TestContract.dispatched_logs.append(evt)
+
+    def _eq1(self, results, kind, expected):
+        self.assertEqual(len(results), 1)
+        self.assertEqual(getattr(results[0], kind)(), expected)
+
+    def _eq0(self, results):
+        self.assertEqual(len(results), 0)
+
+    def _assert_balance(self, balance_params, expected):
+        tx, results, total_ops, engine = TestBuild(self._out, ['balanceOf', balance_params], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBigInteger', expected)
+
+    def _allowance(self, wallet):
+        tx, results, total_ops, engine = TestBuild(self._out, ['allowance', _TOKEN_1_PARAMS], wallet, '0710', '05')
+        return results
+
+    def _assert_token_2(self, token):
+        self.assertEqual(token[b'id'], b'\x02')
+        self.assertEqual(token[b'uri'], b'https://example.com/images/2.png')
+        self.assertEqual(token[b'properties'], b'token2ROData')
 
-        def on_log(evt):
-            print(evt)
-            cls.dispatched_logs.append(evt)
-        events.on(SmartContractEvent.RUNTIME_NOTIFY, on_notif)
-        events.on(SmartContractEvent.RUNTIME_LOG, on_log)
-        print("1:{}\n2:{}\n3:{}\n".format(BoaFixtureTest.wallet_1_script_hash.Data,
-              BoaFixtureTest.wallet_2_script_hash.Data,
-              BoaFixtureTest.wallet_3_script_hash.Data))
+    def _assert_owner_uris(self, tokens, token_2_uri):
+        # tokens maps each of the owner's token ids to its decoded record
+        self.assertEqual(sorted(tokens.keys()), [b'\x01', b'\x02', b'\x03', b'\x04'])
+        self.assertEqual(tokens[b'\x01'][b'uri'], b'https://example.com/images/1.png')
+        self.assertEqual(tokens[b'\x02'][b'uri'], token_2_uri.encode())
+        self.assertEqual(tokens[b'\x02'][b'properties'], b'token2ROData')
 
     def test_NFT_1(self):
 
-        output = Compiler.instance().load('nft_template.py').default
-        out = output.write()
+        out = self._out
 
         tx, results, total_ops, engine = TestBuild(out, ['name', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetString(), TOKEN_NAME)
+        self._eq1(results, 'GetString', TOKEN_NAME)
 
         tx, results, total_ops, engine = TestBuild(out, ['symbol', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetString(), TOKEN_SYMBOL)
+        self._eq1(results, 'GetString', TOKEN_SYMBOL)
 
         tx, results, total_ops, engine = TestBuild(out, ['decimals', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), TOKEN_DECIMALS)
+        self._eq1(results, 'GetBigInteger', TOKEN_DECIMALS)
 
         tx, results, total_ops, engine = TestBuild(out, ['nonexistentmethod', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        self._eq0(results)
 
 	# mint a token
-        owner = bytearray(TOKEN_CONTRACT_OWNER)
-        tx, results, total_ops, engine = TestBuild(out, ['mintToken', parse_param([owner,1,'token1ROData','https://example.com/images/1.png','token1ROData'])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['mintToken', _MINT_1_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
         # now circulation should be equal to 1
         tx, results, total_ops, engine = TestBuild(out, ['totalSupply', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 1)
+        self._eq1(results, 'GetBigInteger', 1)
 
         # now the owner should have a balance of 1
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([bytearray(TOKEN_CONTRACT_OWNER)])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 1)
+        self._assert_balance(_OWNER_PARAMS, 1)
 
     def test_NFT_2(self):
 
-        output = Compiler.instance().load('nft_template.py').default
-        out = output.write()
+        out = self._out
+        w1 = self.wallet_1_script_hash.Data
+        w2 = self.wallet_2_script_hash.Data
+        w3 = self.wallet_3_script_hash.Data
 
         # now transfer tokens to wallet 2
 
-        TestContract.dispatched_events = []
+        TestContract.dispatched_events.clear()
 
         test_transfer_id = 1
-        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([bytearray(TOKEN_CONTRACT_OWNER), self.wallet_2_script_hash.Data, test_transfer_id])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([_OWNER_BA, w2, test_transfer_id])], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
         self.assertEqual(len(TestContract.dispatched_events), 4)
         evt = TestContract.dispatched_events[0]
         self.assertIsInstance(evt, NotifyEvent)
-        self.assertEqual(evt.addr_from.Data, bytearray(TOKEN_CONTRACT_OWNER))
+        self.assertEqual(evt.addr_from.Data, _OWNER_BA)
         self.assertEqual(evt.addr_to, self.wallet_2_script_hash)
         self.assertEqual(evt.amount, 1)
        
         # now get balance of wallet 2
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([self.wallet_2_script_hash.Data])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 1)
+        self._assert_balance(parse_param([w2]), 1)
 
         # now the owner should have less
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([bytearray(TOKEN_CONTRACT_OWNER)])], self.GetWallet1(), '0710', '05')
+        self._assert_balance(_OWNER_PARAMS, 0)
+
+        # the record moved into wallet 2's list with the token...
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerRaw', parse_param([w2, 0])], self.GetWallet1(), '0710', '05')
         self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 0)
+        tokens = [_deserialize(item.GetByteArray()) for item in results[0].GetArray()]
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(tokens[0][b'id'], b'\x01')
+        self.assertEqual(tokens[0][b'uri'], b'https://example.com/images/1.png')
+        self.assertEqual(tokens[0][b'properties'], b'token1ROData')
+
+        # ...and left the owner's list empty
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerRaw', _OWNER_TOKENS_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
         # now this transfer should fail
-        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([bytearray(TOKEN_CONTRACT_OWNER), self.wallet_3_script_hash.Data, test_transfer_id])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([_OWNER_BA, w3, test_transfer_id])], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
         # this transfer should fail because it is not signed by the 'from' address
-        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([bytearray(TOKEN_CONTRACT_OWNER), self.wallet_3_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([_OWNER_BA, w3, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
 
         # now this transfer should fail, this is from address with no tokens
-        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([self.wallet_3_script_hash.Data, self.wallet_1_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([w3, w1, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
+
+        # a self-transfer of a token you don't own should fail
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([w3, w3, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
+
+        # a self-transfer of a token that doesn't exist should fail
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([w3, w3, 999999])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
+
+        # a transfer of a token id longer than any mintable id should fail
+        tx, results, total_ops, engine = TestBuild(out, ['transfer', parse_param([w2, _LONG_TOKEN_ID])], self.GetWallet2(), '0710', '05')
+        self._eq0(results)
 
         # get balance of bad data
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param(['abc'])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', _BAD_ADDRESS_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
         # get balance no params
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', _NO_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
     def test_NFT_3_mint(self):
 
-        output = Compiler.instance().load('nft_template.py').default
-        out = output.write()
+        out = self._out
 
-        TestContract.dispatched_events = []
+        TestContract.dispatched_events.clear()
 
 	# mint another token
-        owner = bytearray(TOKEN_CONTRACT_OWNER)
-        tx, results, total_ops, engine = TestBuild(out, ['mintToken', parse_param([owner,2,'token2ROData','https://example.com/images/2.png','token2ROData'])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['mintToken', _MINT_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
         # it should dispatch an event
         self.assertEqual(len(TestContract.dispatched_events), 8)
@@ -164,55 +286,96 @@ class TestContract(BoaFixtureTest):
         self.assertIsInstance(evt, NotifyEvent)
         self.assertEqual(evt.addr_to, self.wallet_1_script_hash)
 
+        # the owner's tokens can be listed without serialization; token 1
+        # has already moved to wallet 2, so only token 2 is left
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerRaw', _OWNER_TOKENS_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        tokens = [_deserialize(item.GetByteArray()) for item in results[0].GetArray()]
+        self.assertEqual(len(tokens), 1)
+        self._assert_token_2(tokens[0])
+
+        # tokensOfOwner maps each id to the token's serialized data
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwner', _OWNER_TOKENS_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        tokens = _deserialize(results[0].GetByteArray())
+        self.assertEqual(list(tokens.keys()), [b'\x02'])
+        self._assert_token_2(_deserialize(tokens[b'\x02']))
+
+        # tokensOfOwnerIter hands back the storage iterator itself
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerIter', _OWNER_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        token_iter = results[0].GetInterface()
+        keys = []
+        tokens = []
+        while token_iter.Next():
+            keys.append(token_iter.Key().GetByteArray())
+            tokens.append(_deserialize(token_iter.Value().GetByteArray()))
+        # owner-list keys carry their own tag, so they can't share a key
+        # with any tag + token id record
+        self.assertEqual(keys, [OWNERS_LIST_PREFIX + _OWNER_BA + b'\x02'])
+        self.assertEqual(len(tokens), 1)
+        self._assert_token_2(tokens[0])
+
         # now the total circulation should be bigger
         tx, results, total_ops, engine = TestBuild(out, ['totalSupply', '[]'], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 2)
+        self._eq1(results, 'GetBigInteger', 2)
+
+        # minting without the contract owner's witness should fault
+        tx, results, total_ops, engine = TestBuild(out, ['mintToken', _MINT_2_PARAMS], self.GetWallet2(), '0710', '05')
+        self._eq0(results)
 
 	# trying to mint a token with an existing token ID should fail
-        owner = bytearray(TOKEN_CONTRACT_OWNER)
-        tx, results, total_ops, engine = TestBuild(out, ['mintToken', parse_param([owner,2,'token2ROData','https://example.com/images/2.png','token2ROData'])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['mintToken', _MINT_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
 
     def test_NFT_4_approval(self):
 
-        output = Compiler.instance().load('nft_template.py').default
-        out = output.write()
+        out = self._out
+        w1 = self.wallet_1_script_hash.Data
+        w2 = self.wallet_2_script_hash.Data
+        w3 = self.wallet_3_script_hash.Data
 
         # get balance of wallet 2
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([self.wallet_2_script_hash.Data])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 1)
+        self._assert_balance(parse_param([w2]), 1)
 
         # get owner of token 1
-        tx, results, total_ops, engine = TestBuild(out, ['ownerOf', parse_param([1])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetByteArray(), self.wallet_2_script_hash.Data)
+        tx, results, total_ops, engine = TestBuild(out, ['ownerOf', _TOKEN_1_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetByteArray', w2)
+
+        # owner of a token id longer than any mintable id should fail
+        tx, results, total_ops, engine = TestBuild(out, ['ownerOf', _LONG_TOKEN_ID_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
 
         # tranfer_from, approve, allowance
-        tx, results, total_ops, engine = TestBuild(out, ['allowance', parse_param([1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 0)
+        results = self._allowance(self.GetWallet3())
+        self._eq1(results, 'GetBigInteger', 0)
 
         # try to transfer from
-        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([self.wallet_2_script_hash.Data, self.wallet_3_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([w2, w3, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
 
         # try to approve from someone not yourself
-        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([self.wallet_2_script_hash.Data, self.wallet_2_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w2, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
 
         # try to approve a token you don't own
-        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([self.wallet_3_script_hash.Data, self.wallet_2_script_hash.Data, 999999])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w3, w2, 999999])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
 
-        TestContract.dispatched_events = []
+        # approving a token id longer than any mintable id should fail
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w3, _LONG_TOKEN_ID])], self.GetWallet2(), '0710', '05')
+        self._eq0(results)
+
+        # so should transferring one from an approved spender
+        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([w3, w2, w1, _LONG_TOKEN_ID])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
+
+        TestContract.dispatched_events.clear()
 
         # approve should work
-        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([self.wallet_2_script_hash.Data, self.wallet_3_script_hash.Data, 1])], self.GetWallet2(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w3, 1])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
         # it should dispatch an event
         self.assertEqual(len(TestContract.dispatched_events), 4)
@@ -222,48 +385,186 @@ class TestContract(BoaFixtureTest):
         self.assertEqual(evt.amount, 1)
 
         # check allowance
-        tx, results, total_ops, engine = TestBuild(out, ['allowance', parse_param([1])], self.GetWallet1(), '0710', '05')
+        results = self._allowance(self.GetWallet1())
         self.assertEqual(len(results), 1)
         self.assertEqual(len(results[0].GetByteArray()), 40)
 
         # approve should not be additive, it should overwrite previous approvals
-        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([self.wallet_2_script_hash.Data, self.wallet_3_script_hash.Data, 1])], self.GetWallet2(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w3, 1])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
-        tx, results, total_ops, engine = TestBuild(out, ['allowance', parse_param([1])], self.GetWallet2(), '0710', '05')
+        results = self._allowance(self.GetWallet2())
         self.assertEqual(len(results), 1)
         self.assertEqual(len(results[0].GetByteArray()), 40)
 
         # nash-style transferFrom should fail because call is not from a whitelisted DEX
-        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([self.wallet_2_script_hash.Data, self.wallet_3_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 0)
+        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([w2, w3, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
 
-        # receiver currently should have one token
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([self.wallet_1_script_hash.Data])], self.GetWallet1(), '0710', '05')
+        # revoking the approval leaves only the owner in the record
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w3, 1, 1])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
+
+        results = self._allowance(self.GetWallet2())
         self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 1)
+        self.assertEqual(len(results[0].GetByteArray()), 0)
+
+        # so the formerly approved spender can no longer transfer it
+        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([w3, w2, w1, 1])], self.GetWallet3(), '0710', '05')
+        self._eq0(results)
+
+        tx, results, total_ops, engine = TestBuild(out, ['ownerOf', _TOKEN_1_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetByteArray', w2)
+
+        # approve again for the transfer below
+        tx, results, total_ops, engine = TestBuild(out, ['approve', parse_param([w2, w3, 1])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
+
+        # receiver currently should have one token
+        self._assert_balance(parse_param([w1]), 1)
 
         # moonlight-style transferFrom with originator/spender should work
-        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([self.wallet_3_script_hash.Data, self.wallet_2_script_hash.Data, self.wallet_1_script_hash.Data, 1])], self.GetWallet3(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBoolean(), True)
+        tx, results, total_ops, engine = TestBuild(out, ['transferFrom', parse_param([w3, w2, w1, 1])], self.GetWallet3(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
 
         # now the receiver should have two tokens
 
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([self.wallet_1_script_hash.Data])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 2)
+        self._assert_balance(parse_param([w1]), 2)
 
         # now the previous owner should have no balance
 
-        tx, results, total_ops, engine = TestBuild(out, ['balanceOf', parse_param([self.wallet_2_script_hash.Data])], self.GetWallet1(), '0710', '05')
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0].GetBigInteger(), 0)
+        self._assert_balance(parse_param([w2]), 0)
 
         # now the allowance should be removed for this token
 
-        tx, results, total_ops, engine = TestBuild(out, ['allowance', parse_param([1])], self.GetWallet2(), '0710', '05')
+        results = self._allowance(self.GetWallet2())
         self.assertEqual(len(results), 1)
         self.assertEqual(len(results[0].GetByteArray()), 0)
 
+    def test_NFT_5_properties(self):
+
+        out = self._out
+        w2 = self.wallet_2_script_hash.Data
+
+        # token 2 was minted by test_NFT_3_mint with read-only and read/write data
+        tx, results, total_ops, engine = TestBuild(out, ['properties', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetString', 'token2ROData')
+
+        tx, results, total_ops, engine = TestBuild(out, ['rwProperties', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetString', 'token2ROData')
+
+        # a well-formed id that was never minted has no properties
+        tx, results, total_ops, engine = TestBuild(out, ['properties', _MISSING_TOKEN_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', False)
+
+        tx, results, total_ops, engine = TestBuild(out, ['rwProperties', _MISSING_TOKEN_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', False)
+
+        # only the dApp admin can set read/write data
+        tx, results, total_ops, engine = TestBuild(out, ['setRWProperties', parse_param([2, 'token2RWData'])], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
+
+        tx, results, total_ops, engine = TestBuild(out, ['setRWProperties', parse_param([999999, 'token2RWData'])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', False)
+
+        tx, results, total_ops, engine = TestBuild(out, ['setRWProperties', parse_param([2, 'token2RWData'])], self.GetWallet2(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
+
+        tx, results, total_ops, engine = TestBuild(out, ['rwProperties', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetString', 'token2RWData')
+
+        # read-only data is unchanged
+        tx, results, total_ops, engine = TestBuild(out, ['properties', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetString', 'token2ROData')
+
+        # token merges the read/write data back into the record
+        tx, results, total_ops, engine = TestBuild(out, ['token', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        token = _deserialize(results[0].GetByteArray())
+        self.assertEqual(token[b'id'], b'\x02')
+        self.assertEqual(token[b'uri'], b'https://example.com/images/2.png')
+        self.assertEqual(token[b'properties'], b'token2ROData')
+        self.assertEqual(token[b'rwproperties'], b'token2RWData')
+
+        tx, results, total_ops, engine = TestBuild(out, ['token', _MISSING_TOKEN_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
+
+    def test_NFT_6_batch_mint(self):
+
+        out = self._out
+        w1 = self.wallet_1_script_hash.Data
+
+        # batch minting without the contract owner's witness should fault
+        tx, results, total_ops, engine = TestBuild(out, ['mintTokenBatch', _BATCH_MINT_PARAMS], self.GetWallet2(), '0710', '05')
+        self._eq0(results)
+
+        tx, results, total_ops, engine = TestBuild(out, ['mintTokenBatch', _BATCH_MINT_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
+
+        # both tokens count towards the supply and the owner's balance
+        tx, results, total_ops, engine = TestBuild(out, ['totalSupply', '[]'], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBigInteger', 4)
+        self._assert_balance(_OWNER_PARAMS, 4)
+
+        for t_id in (3, 4):
+            tx, results, total_ops, engine = TestBuild(out, ['ownerOf', parse_param([t_id])], self.GetWallet1(), '0710', '05')
+            self._eq1(results, 'GetByteArray', w1)
+
+        # a batch repeating an id faults as a whole
+        duplicate_params = parse_param([
+            [_OWNER_BA, 5, 'token5ROData', 'https://example.com/images/5.png'],
+            [_OWNER_BA, 5, 'token5ROData', 'https://example.com/images/5.png']])
+        tx, results, total_ops, engine = TestBuild(out, ['mintTokenBatch', duplicate_params], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
+
+        # so does a batch containing an id that was already minted
+        existing_params = parse_param([
+            [_OWNER_BA, 6, 'token6ROData', 'https://example.com/images/6.png'],
+            [_OWNER_BA, 3, 'token3ROData', 'https://example.com/images/3.png']])
+        tx, results, total_ops, engine = TestBuild(out, ['mintTokenBatch', existing_params], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
+
+        # and neither failed batch left any of its tokens behind
+        for t_id in (5, 6):
+            tx, results, total_ops, engine = TestBuild(out, ['ownerOf', parse_param([t_id])], self.GetWallet1(), '0710', '05')
+            self._eq0(results)
+
+        tx, results, total_ops, engine = TestBuild(out, ['totalSupply', '[]'], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBigInteger', 4)
+        self._assert_balance(_OWNER_PARAMS, 4)
+
+    def test_NFT_7_modify_uri(self):
+
+        out = self._out
+        new_uri = 'https://example.com/images/2b.png'
+
+        # only an existing token's URI can be modified
+        tx, results, total_ops, engine = TestBuild(out, ['modifyURI', parse_param([999999, new_uri])], self.GetWallet1(), '0710', '05')
+        self._eq0(results)
+
+        tx, results, total_ops, engine = TestBuild(out, ['modifyURI', parse_param([2, new_uri])], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetBoolean', True)
+
+        tx, results, total_ops, engine = TestBuild(out, ['uri', _TOKEN_2_PARAMS], self.GetWallet1(), '0710', '05')
+        self._eq1(results, 'GetString', new_uri)
+
+        # the copy of the record kept in the owner's list follows the new
+        # URI in every view of that list; the owner holds tokens 1 to 4
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerRaw', _OWNER_TOKENS_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        tokens = [_deserialize(item.GetByteArray()) for item in results[0].GetArray()]
+        self._assert_owner_uris(dict((token[b'id'], token) for token in tokens), new_uri)
+
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwner', _OWNER_TOKENS_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        tokens = _deserialize(results[0].GetByteArray())
+        self._assert_owner_uris(dict((t_id, _deserialize(data)) for t_id, data in tokens.items()), new_uri)
+
+        tx, results, total_ops, engine = TestBuild(out, ['tokensOfOwnerIter', _OWNER_PARAMS], self.GetWallet1(), '0710', '05')
+        self.assertEqual(len(results), 1)
+        token_iter = results[0].GetInterface()
+        tokens = {}
+        while token_iter.Next():
+            token = _deserialize(token_iter.Value().GetByteArray())
+            tokens[token[b'id']] = token
+        self._assert_owner_uris(tokens, new_uri)